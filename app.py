@@ -1,5 +1,6 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 from flask_cors import CORS 
+from validation_engine import current_engine, lookup_stats
 
 app = Flask(__name__)
 CORS(app)
@@ -44,30 +45,30 @@ def get_alert_status():
 
 @app.route('/get_validation', methods=['GET']) 
 def get_validation_data():
-    satellite_no2 = 15.5
-    ground_no2 = 14.8
-    difference = satellite_no2 - ground_no2
-    
-    if ground_no2 == 0:
-        percent_difference = 0
-    else:
-        percent_difference = (abs(difference) / ground_no2) * 100
+    # Statistics are kept up to date by combine_data.py; this is a cached lookup
+    result = lookup_stats(current_engine(), request.args)
+    stats, window = result["statistics"], result["window"]
+    if stats is None:
+        return jsonify({"error": f"No validation statistics for {result['scope']} '{result['key']}' in window '{window}'."}), 404
 
-    if difference > 0:
-        trend = "higher"
+    # NO2 column vs. surface PM2.5 have different units, so only the correlation is compared
+    correlation = stats["correlation"]
+    if correlation is None:
+        validation_text = f"Not enough varied data in the last {window} to correlate TEMPO NO2 with ground PM2.5."
     else:
-        trend = "lower"
-        
-    validation_text = (
-        f"The TEMPO satellite reading is {percent_difference:.1f}% {trend} "
-        f"than the closest ground sensor."
-    )
+        validation_text = (
+            f"Over the last {window}, TEMPO NO2 and matched ground PM2.5 have a correlation "
+            f"of r = {correlation:.2f} ({stats['count']} pairs)."
+        )
 
     return jsonify({
-        "satellite_value": satellite_no2,
-        "ground_value": ground_no2,
-        "difference_percent": f"{percent_difference:.1f}%",
-        "validation_message": validation_text
+        "satellite_value": stats["mean_satellite_no2"],
+        "satellite_units": stats["satellite_units"],
+        "ground_value": stats["mean_ground_pm25"],
+        "ground_units": stats["ground_units"],
+        "correlation": correlation,
+        "validation_message": validation_text,
+        **result
     })
 
 @app.route('/get_map_data', methods=['GET'])
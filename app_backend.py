@@ -1,10 +1,12 @@
 # app_backend.py
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
 import pickle
 import numpy as np
 import pandas as pd
 import os
 from model_forecast import pm25_to_aqi_level # Import the helper function from the model script
+from validation_engine import current_engine, lookup_stats, DEFAULT_WINDOW
+from forecast_stream import ForecastBroadcaster, SSE_HEADERS
 
 # --- Configuration ---
 
@@ -15,6 +17,7 @@ ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 # 2. Use the absolute path for file loading
 MODEL_FILE = os.path.join(ROOT_DIR, 'model', 'air_quality_model.pkl')
 MASTER_FILE = os.path.join(ROOT_DIR, 'data_processed', 'master_data_for_model.csv')
+VALIDATION_FILE = os.path.join(ROOT_DIR, 'data_processed', 'validation_stats.pkl')
 
 # 3. Explicitly define the template folder path (D:\gryffinCoders\templates)
 template_dir = os.path.join(ROOT_DIR, 'templates')
@@ -23,6 +26,20 @@ app = Flask(__name__, template_folder=template_dir)
 
 df_master = None
 model = None
+# Modification times of (MODEL_FILE, MASTER_FILE) when last loaded
+loaded_mtimes = None
+
+# One broadcaster shared by every /api/stream client
+broadcaster = ForecastBroadcaster()
+
+# Alert text per AQI level from pm25_to_aqi_level()
+ALERT_MESSAGES = {
+    "Good": ("Air Quality is Good. Enjoy the outdoors!", "No restrictions needed."),
+    "Moderate": ("Air Quality is Moderate.", "Unusually sensitive people should consider limiting long outdoor time."),
+    "Unhealthy for Sensitive Groups": ("Air is UNHEALTHY for sensitive groups.", "Limit prolonged or heavy exertion outdoors."),
+    "Unhealthy": ("Air is UNHEALTHY. Health risk is elevated.", "Everyone should reduce outdoor exertion."),
+    "Hazardous": ("Air is HAZARDOUS.", "Everyone should avoid outdoor exertion."),
+}
 
 # Load the model and data when the server starts
 def load_resources():
@@ -41,22 +58,17 @@ def load_resources():
         df_master = None
         print("Ensure 'model_forecast.py' was run successfully and files exist at the paths above.")
 
-# ----------------------------------------------------
-# --- API ROUTES ---
-# ----------------------------------------------------
+def resource_mtimes():
+    """Modification times of the model and master data (None if a file is missing)."""
+    return tuple(os.path.getmtime(path) if os.path.exists(path) else None for path in (MODEL_FILE, MASTER_FILE))
 
-@app.route('/')
-def index():
-    """Serves the main HTML page for the frontend."""
-    return render_template('index.html')
-
-@app.route('/api/forecast', methods=['GET'])
-def get_forecast():
+def build_forecast():
     """
-    API endpoint to get the predicted PM2.5 and AQI level for a location.
+    Predicts PM2.5 and the AQI level from the last data record.
+    Returns (forecast dict, None) on success or (None, error message).
     """
     if model is None or df_master is None:
-        return jsonify({"error": "Server not ready (model/data missing). Check terminal logs."}), 500
+        return None, "Server not ready (model/data missing). Check terminal logs."
         
     # Get the last data point's features for a quick demonstration
     last_row = df_master.tail(1)
@@ -70,7 +82,7 @@ def get_forecast():
     ]].values
     
     if len(features) == 0:
-        return jsonify({"error": "No valid data to generate prediction."}), 500
+        return None, "No valid data to generate prediction."
     
     # Predict PM2.5
     predicted_pm25 = model.predict(features)[0]
@@ -79,13 +91,101 @@ def get_forecast():
     # Convert to AQI level
     aqi_data = pm25_to_aqi_level(predicted_pm25)
 
-    return jsonify({
-        "status": "success",
-        "predicted_pm25": round(predicted_pm25, 2),
+    # Where/when the forecast applies, so clients don't mistake it for another location's
+    scan_time = last_row['datetime'].iloc[0] if 'datetime' in last_row else None
+
+    return {
+        "predicted_pm25": round(float(predicted_pm25), 2),
         "aqi_level": aqi_data["level"],
         "aqi_color": aqi_data["color"],
+        "latitude": round(float(last_row['latitude'].iloc[0]), 4),
+        "longitude": round(float(last_row['longitude'].iloc[0]), 4),
+        "scan_time_utc": None if pd.isna(scan_time) else str(scan_time),
         "location_context": "Prediction based on the model's features from last data record." 
-    })
+    }, None
+
+def build_alert(forecast):
+    """Alert state derived from a forecast's AQI level."""
+    title, action = ALERT_MESSAGES[forecast["aqi_level"]]
+    return {
+        "aqi_level": forecast["aqi_level"],
+        "aqi_color": forecast["aqi_color"],
+        "alert_active": forecast["aqi_level"] not in ("Good", "Moderate"),
+        "alert_title": title,
+        "recommended_action": action
+    }
+
+def publish_updates():
+    """
+    Publishes the current forecast, alert and validation state to /api/stream.
+    Resources are re-loaded only when their files change, and the broadcaster
+    only sends clients the fields that differ from the last publish.
+    """
+    global loaded_mtimes
+    mtimes = resource_mtimes()
+    if mtimes != loaded_mtimes:
+        load_resources()
+        loaded_mtimes = mtimes
+
+    forecast, _ = build_forecast()
+    if forecast is not None:
+        broadcaster.publish('forecast', forecast)
+        broadcaster.publish('alert', build_alert(forecast))
+
+    engine = current_engine(VALIDATION_FILE)
+    stats = engine.get_stats()
+    if stats is not None:
+        broadcaster.publish('validation', {
+            "window": DEFAULT_WINDOW,
+            "window_end_utc": engine.window_end_utc(),
+            **stats
+        })
+
+# ----------------------------------------------------
+# --- API ROUTES ---
+# ----------------------------------------------------
+
+@app.route('/')
+def index():
+    """Serves the main HTML page for the frontend."""
+    return render_template('index.html')
+
+@app.route('/api/forecast', methods=['GET'])
+def get_forecast():
+    """
+    API endpoint to get the predicted PM2.5 and AQI level for a location.
+    """
+    forecast, error = build_forecast()
+    if forecast is None:
+        return jsonify({"error": error}), 500
+
+    return jsonify({"status": "success", **forecast})
+
+@app.route('/api/stream', methods=['GET'])
+def stream_updates():
+    """
+    Server-Sent Events endpoint: sends the current forecast, alert and validation
+    state on connect, then a compact delta whenever a new one is published.
+    """
+    broadcaster.start_publisher(publish_updates)
+    return Response(broadcaster.stream(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+def lookup_validation_stats():
+    """Looks up the cached correlation/means for the station, region and window in the query string."""
+    # Statistics are updated incrementally by combine_data.py; serving is a dict lookup
+    return lookup_stats(current_engine(VALIDATION_FILE), request.args)
+
+@app.route('/api/validation/stats', methods=['GET'])
+def get_validation_stats():
+    """
+    API endpoint for satellite-vs-ground validation statistics.
+    Query params: station=<id> or region=<lat_lon cell>, window=1h|24h|7d.
+    """
+    result = lookup_validation_stats()
+    if result["statistics"] is None:
+        return jsonify({"error": f"No validation statistics for {result['scope']} '{result['key']}' in window '{result['window']}'."}), 404
+
+    return jsonify({"status": "success", **result})
 
 @app.route('/api/validation', methods=['GET'])
 def get_validation_data():
@@ -110,10 +210,13 @@ def get_validation_data():
 
     return jsonify({
         "status": "success",
-        "recent_validation_data": validation_list
+        "recent_validation_data": validation_list,
+        "validation_stats": lookup_validation_stats()
     })
 
 if __name__ == '__main__':
     load_resources()
+    loaded_mtimes = resource_mtimes()
     print("\n--- Flask Server Starting ---")
-    app.run(debug=True)
\ No newline at end of file
+    # threaded=True so each open /api/stream connection gets its own worker thread
+    app.run(debug=True, threaded=True)
\ No newline at end of file
@@ -3,6 +3,7 @@ import pandas as pd
 import numpy as np
 from sklearn.neighbors import BallTree 
 import os
+from validation_engine import load_engine, save_engine, file_batch_id, VALIDATION_FILE
 
 # --- File Paths ---
 # Member A output
@@ -32,13 +33,21 @@ except FileNotFoundError as e:
 # Standardization and Cleanup
 # TEMPO: Cleanup NaNs and standardize time
 df_tempo.dropna(subset=['latitude', 'longitude'], inplace=True) 
-df_tempo['datetime'] = pd.to_datetime(df_tempo['NO2_column_density'], errors='coerce') # NOTE: Assuming 'datetime' column is missing or needs better parsing from TEMPO data
-df_tempo.dropna(subset=['datetime'], inplace=True) 
+# Use the real scan time written by read_tempo.py. Rows without one keep NaT:
+# they can still train the model but are skipped by the time-windowed validation.
+if 'scan_time_utc' in df_tempo.columns:
+    df_tempo['datetime'] = pd.to_datetime(df_tempo['scan_time_utc'], utc=True, errors='coerce')
+else:
+    print("WARNING: TEMPO file has no 'scan_time_utc' column. Re-run read_tempo.py; validation statistics will not be updated.")
+    df_tempo['datetime'] = pd.NaT
 
 # OPENAQ: Cleanup NaNs, standardize time, and rename columns for clarity
 df_openaq.dropna(subset=['latitude', 'longitude', 'pollutant_value'], inplace=True)
 df_openaq.rename(columns={'pollutant_value': 'openaq_pm25', 'timestamp_utc': 'datetime'}, inplace=True)
-df_openaq['datetime'] = pd.to_datetime(df_openaq['datetime'], utc=True, errors='coerce')
+# get_openaq.py stores the API's time object as a string: "{'utc': '...', 'local': '...'}"
+openaq_time = df_openaq['datetime'].astype(str)
+openaq_time = openaq_time.str.extract(r"'utc':\s*'([^']+)'", expand=False).fillna(openaq_time)
+df_openaq['datetime'] = pd.to_datetime(openaq_time, utc=True, errors='coerce')
 
 # WEATHER: Already cleaned and contains 51 unique points
 df_weather.dropna(inplace=True) 
@@ -82,12 +91,20 @@ if len(coords_openaq) > 0:
     distances, indices = tree.query(np.radians(coords_master), k=1)
     
     # Add the nearest OpenAQ PM2.5 value and its distance
-    df_master['nearest_openaq_pm25'] = df_openaq.loc[indices[:, 0], 'openaq_pm25'].values
+    # Positional (.iloc) lookups: dropna() leaves gaps in df_openaq's index labels
+    df_master['nearest_openaq_pm25'] = df_openaq['openaq_pm25'].iloc[indices[:, 0]].values
     df_master['distance_km_to_openaq'] = distances.flatten() * 6371  # Earth radius in km
+    # Station ID (rounded station coordinates) used to key validation statistics
+    station_ids = df_openaq['latitude'].round(4).astype(str) + '_' + df_openaq['longitude'].round(4).astype(str)
+    df_master['nearest_openaq_station'] = station_ids.iloc[indices[:, 0]].values
+    # Reading time, so validation can pair only readings taken near the scan time
+    df_master['openaq_datetime_utc'] = df_openaq['datetime'].iloc[indices[:, 0]].values
 else:
     print("WARNING: OpenAQ data is empty. Skipping Nearest Neighbor calculation.")
     df_master['nearest_openaq_pm25'] = np.nan
     df_master['distance_km_to_openaq'] = np.nan
+    df_master['nearest_openaq_station'] = np.nan
+    df_master['openaq_datetime_utc'] = pd.NaT
 
 print("Nearest OpenAQ neighbor calculation complete.")
 
@@ -104,7 +121,7 @@ final_columns = ['datetime', 'latitude', 'longitude',
                  # Weather Data
                  'current_temp_C', 'current_wind_speed_m_s', 'current_wind_direction_deg', 
                  # OpenAQ Validation Data
-                 'nearest_openaq_pm25', 'distance_km_to_openaq']
+                 'nearest_openaq_pm25', 'distance_km_to_openaq', 'nearest_openaq_station', 'openaq_datetime_utc']
 
 # Filter the master DF to only include the final columns 
 final_master_df = df_master.reindex(columns=final_columns, fill_value=np.nan)
@@ -113,6 +130,16 @@ final_master_df = df_master.reindex(columns=final_columns, fill_value=np.nan)
 os.makedirs(os.path.dirname(MASTER_FILE), exist_ok=True)
 final_master_df.to_csv(MASTER_FILE, index=False)
 
+# =========================================================================
+# --- Step 6: Update Validation Statistics (incremental, this batch only) ---
+# =========================================================================
+
+validation_engine = load_engine(VALIDATION_FILE)
+# Keyed on the TEMPO file contents so re-running on the same granule is a no-op
+rows_used = validation_engine.update(final_master_df, batch_id=file_batch_id(TEMPO_FILE))
+save_engine(validation_engine, VALIDATION_FILE)
+print(f"Validation statistics updated with {rows_used} paired rows. Saved to: {VALIDATION_FILE}")
+
 print(f"\n=========================================================================")
 print(f"SUCCESS! MEMBER B'S DELIVERABLE IS READY.")
 print(f"File: {MASTER_FILE}")
@@ -0,0 +1,143 @@
+# forecast_stream.py
+import json
+import queue
+import threading
+import time
+
+# --- Configuration ---
+# Messages buffered per subscriber before a slow client is dropped (it will reconnect)
+SUBSCRIBER_QUEUE_SIZE = 32
+# Comment line sent on idle connections so proxies don't close them
+KEEPALIVE_SECONDS = 15
+# How often the publisher thread checks for new forecast/alert state
+PUBLISH_INTERVAL_SECONDS = 10
+# Event name for full-state messages; clients replace (not merge) that channel's state
+SNAPSHOT_EVENT = 'snapshot'
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+}
+
+
+def encode_event(channel, data, event_id):
+    """Encodes one Server-Sent Event as bytes, ready to write to any number of clients."""
+    payload = json.dumps(data, separators=(',', ':'), default=str)
+    return f"id: {event_id}\nevent: {channel}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class ForecastBroadcaster:
+    """
+    Fans forecast/alert/validation updates out to all connected dashboards.
+
+    Each channel keeps its last published state. publish() only sends the
+    fields that changed (removed fields are sent as null) as an event named
+    after the channel, encodes that delta once and hands the same bytes to
+    every subscriber queue. New (or reconnecting) subscribers first receive a
+    'snapshot' event per channel, {"channel": ..., "state": {...}}, which
+    replaces whatever state the client had for that channel.
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._state = {}      # channel -> last published payload
+        self._snapshots = {}  # channel -> encoded snapshot event for new subscribers
+        self._event_id = 0
+        self._publisher = None
+
+    def publish(self, channel, payload):
+        """Publishes a channel's new state. Returns False if nothing changed."""
+        with self._lock:
+            previous = self._state.get(channel, {})
+            delta = {key: value for key, value in payload.items() if previous.get(key) != value}
+            for key in previous:
+                if key not in payload:
+                    delta[key] = None
+
+            if not delta:
+                return False
+
+            self._event_id += 1
+            self._state[channel] = dict(payload)
+            self._snapshots[channel] = encode_event(SNAPSHOT_EVENT, {"channel": channel, "state": payload}, self._event_id)
+            message = encode_event(channel, delta, self._event_id)
+
+            dropped = []
+            for subscriber in self._subscribers:
+                try:
+                    subscriber.put_nowait(message)
+                except queue.Full:
+                    dropped.append(subscriber)
+
+            for subscriber in dropped:
+                self._drop(subscriber)
+
+        return True
+
+    def subscribe(self):
+        """Registers a new client; returns its queue and the current snapshots."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            snapshots = list(self._snapshots.values())
+        return subscriber, snapshots
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _drop(self, subscriber):
+        """Disconnects a client that fell behind (called with the lock held)."""
+        self._subscribers.discard(subscriber)
+        with subscriber.mutex:
+            subscriber.queue.clear()
+        subscriber.put_nowait(None)  # Tells stream() to end the response
+
+    def start_publisher(self, publish_updates, interval_seconds=PUBLISH_INTERVAL_SECONDS):
+        """
+        Runs publish_updates() now and then every interval in a daemon thread.
+        Safe to call on every request; only the first call starts the thread.
+        """
+        with self._lock:
+            if self._publisher is not None:
+                return self._publisher
+
+            def run():
+                while True:
+                    try:
+                        publish_updates()
+                    except Exception as e:
+                        print(f"ERROR: Failed to publish live updates. Error: {e}")
+                    time.sleep(interval_seconds)
+
+            self._publisher = threading.Thread(target=run, name='forecast-publisher', daemon=True)
+            self._publisher.start()
+            return self._publisher
+
+    def stream(self):
+        """Generator for a Flask streaming response (text/event-stream)."""
+        subscriber, snapshots = self.subscribe()
+        try:
+            # Reconnect quickly if the connection drops
+            yield b"retry: 3000\n\n"
+            for snapshot in snapshots:
+                yield snapshot
+
+            while True:
+                try:
+                    message = subscriber.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield b": keepalive\n\n"
+                    continue
+
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
@@ -1,16 +1,49 @@
 # model_forecast.py
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, TimeSeriesSplit
 from sklearn.linear_model import LinearRegression
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.metrics import mean_squared_error
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import make_pipeline
+from joblib import Memory, Parallel, delayed
 import numpy as np
 import pickle 
 import os # <--- FIX: ADDED OS IMPORT
+import sys
+import time
 
 # --- Configuration ---
 MASTER_FILE = '../data_processed/master_data_for_model.csv'
 MODEL_FILE = '../model/air_quality_model.pkl'
 
+# --- Model Selection Configuration ---
+LEADERBOARD_FILE = '../model/model_leaderboard.csv'
+FEATURE_CACHE_DIR = '../model/feature_cache'
+TARGET_COL = 'nearest_openaq_pm25'
+
+# The four features the served model (app_backend.py) uses
+BASE_FEATURES = [
+    'NO2_column_density',
+    'current_temp_C',
+    'current_wind_speed_m_s',
+    'current_wind_direction_deg'
+]
+
+# Lag/rolling features are built per grid cell from these columns, in time steps of
+# the TEMPO scan time ('datetime' = read_tempo.py 'scan_time_utc' via combine_data.py).
+# Weather is a single "current" snapshot (weather_processed.csv), so it has no history to lag.
+LAG_SOURCE_COLS = ['NO2_column_density']
+LAGS = [1, 2, 3]  # Previous scans of the same cell
+MAX_HOURS_PER_LAG = 1.5  # lag k is only used if it is at most k * this many hours older
+ROLLING_WINDOWS_HOURS = [3, 6]  # Time-based rolling means
+GRID_CELL_DEG = 2  # Decimal places used for the grid-cell key (same as combine_data.py)
+
+CV_FOLDS = 5
+N_JOBS = -1  # Use all cores
+LATENCY_ROWS = 10000  # Predict latency is timed on a matrix of this many rows
+LATENCY_REPEATS = 5  # Timed predict calls per model (median is reported)
+
 # --- Simplified AQI Conversion Function ---
 def pm25_to_aqi_level(pm25):
     """Converts predicted PM2.5 (µg/m³) to a simplified AQI health level."""
@@ -73,7 +106,192 @@ def train_and_save_model():
     print(f"SUCCESS: Model saved to {MODEL_FILE}")
     return model
 
+# =========================================================================
+# --- Model Selection: Lag Features + Time-Ordered CV Leaderboard ---
+# =========================================================================
+
+def lagged_feature_names():
+    """Names of the lag/rolling columns produced by build_feature_matrix()."""
+    names = []
+    for col in LAG_SOURCE_COLS:
+        names += [f"{col}_lag{lag}" for lag in LAGS]
+        names += [f"{col}_roll{hours}h" for hours in ROLLING_WINDOWS_HOURS]
+    return names
+
+def build_feature_matrix(master_file, master_mtime):
+    """
+    Loads the master data and adds lag/rolling features per grid cell.
+    master_mtime is only part of the cache key, so an updated file is rebuilt.
+    Rows are returned in time order with no missing base features or target.
+
+    Lags and rolling windows are measured in scan time, so the features are
+    only as good as the master file's 'datetime' (the TEMPO scan time); rows
+    without one are dropped. A lag is NaN when the cell has no recent enough
+    earlier scan (e.g. a master file built from a single granule), and the
+    row is kept so lag-free candidates still get every row.
+    """
+    df = pd.read_csv(master_file)
+    df['datetime'] = pd.to_datetime(df['datetime'], utc=True, errors='coerce')
+    df['grid_cell'] = df['latitude'].round(GRID_CELL_DEG).astype(str) + '_' + df['longitude'].round(GRID_CELL_DEG).astype(str)
+
+    # One row per cell and scan, so lag k is the k-th previous scan rather than a neighbouring pixel
+    value_cols = BASE_FEATURES + [TARGET_COL]
+    df = df.groupby(['grid_cell', 'datetime'], sort=True)[value_cols].mean().reset_index()
+    by_cell = df.groupby('grid_cell', sort=False)
+
+    for lag in LAGS:
+        # Drop lags that reach back too far (missed scans, night-time gaps)
+        gap = df['datetime'] - by_cell['datetime'].shift(lag)
+        too_old = ~(gap <= pd.Timedelta(hours=lag * MAX_HOURS_PER_LAG))
+        for col in LAG_SOURCE_COLS:
+            df[f"{col}_lag{lag}"] = by_cell[col].shift(lag).mask(too_old)
+
+    for hours in ROLLING_WINDOWS_HOURS:
+        # Rows are sorted by cell then time, so the grouped result is in row order
+        rolled = by_cell.rolling(f"{hours}h", on='datetime')[LAG_SOURCE_COLS].mean()
+        for col in LAG_SOURCE_COLS:
+            df[f"{col}_roll{hours}h"] = rolled[col].to_numpy()
+
+    # Same rows for every candidate so their CV scores are comparable
+    columns = ['datetime'] + BASE_FEATURES + lagged_feature_names() + [TARGET_COL]
+    df = df[columns].dropna(subset=['datetime'] + BASE_FEATURES + [TARGET_COL])
+    return df.sort_values('datetime', kind='mergesort').reset_index(drop=True)
+
+def model_candidates():
+    """Candidate configurations: name -> (feature columns, estimator factory)."""
+    lagged = BASE_FEATURES + lagged_feature_names()
+
+    def imputed(estimator):
+        # Lags can be NaN; fill them and add "was missing" flags for models that can't take NaN
+        return make_pipeline(SimpleImputer(strategy='mean', add_indicator=True), estimator)
+
+    # n_jobs=1 inside each model: the parallelism is across folds and candidates
+    return {
+        'linear_base': (BASE_FEATURES, lambda: LinearRegression()),
+        'linear_lagged': (lagged, lambda: imputed(LinearRegression())),
+        'random_forest_lagged': (lagged, lambda: imputed(RandomForestRegressor(n_estimators=200, min_samples_leaf=2, n_jobs=1, random_state=42))),
+        'gradient_boosting_lagged': (lagged, lambda: imputed(GradientBoostingRegressor(n_estimators=300, learning_rate=0.05, max_depth=3, random_state=42))),
+        # Handles missing lags natively
+        'hist_gradient_boosting_lagged': (lagged, lambda: HistGradientBoostingRegressor(max_iter=300, learning_rate=0.05, random_state=42)),
+    }
+
+def observed_columns(X):
+    """Mask of columns with at least one value (a lag never seen in training carries nothing)."""
+    return ~np.isnan(X).all(axis=0)
+
+def evaluate_fold(name, make_model, X, y, train_idx, val_idx):
+    """Fits one candidate on one time-ordered fold; returns fit time and validation error."""
+    model = make_model()
+    columns = observed_columns(X[train_idx])
+
+    start = time.perf_counter()
+    model.fit(X[train_idx][:, columns], y[train_idx])
+    fit_seconds = time.perf_counter() - start
+
+    return {
+        'model': name,
+        'fit_seconds': fit_seconds,
+        'val_mse': mean_squared_error(y[val_idx], model.predict(X[val_idx][:, columns]))
+    }
+
+def fit_full(name, make_model, X, y):
+    """Fits one candidate on all rows (used for the latency benchmark)."""
+    model = make_model()
+    columns = observed_columns(X)
+    model.fit(X[:, columns], y)
+    return name, (model, columns)
+
+def time_predict_ms(model, X_latency):
+    """Median wall time (ms) of predict() on X_latency, after one warm-up call."""
+    model.predict(X_latency)
+    timings = []
+    for _ in range(LATENCY_REPEATS):
+        start = time.perf_counter()
+        model.predict(X_latency)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def select_model(n_jobs=N_JOBS, cv_folds=CV_FOLDS):
+    """
+    Scores every candidate with time-ordered CV (folds and candidates run in
+    parallel) and writes a leaderboard of accuracy vs. training/serving cost.
+    """
+    print("--- Starting Model Selection ---")
+
+    try:
+        master_mtime = os.path.getmtime(MASTER_FILE)
+    except OSError:
+        print(f"ERROR: Master file not found at {MASTER_FILE}. Please run combine_data.py.")
+        return None
+
+    # The feature matrix is built once and cached on disk between runs/candidates
+    memory = Memory(FEATURE_CACHE_DIR, verbose=0)
+    df = memory.cache(build_feature_matrix)(MASTER_FILE, master_mtime)
+
+    # Folds are cut over distinct scan times, so one scan never spans train and validation
+    time_codes, scan_times = pd.factorize(df['datetime'], sort=True)
+    if len(scan_times) <= cv_folds:
+        print(f"ERROR: Only {len(scan_times)} distinct scan times in the master data; need more than {cv_folds}.")
+        return None
+
+    candidates = model_candidates()
+    y = df[TARGET_COL].to_numpy(dtype=float)
+    # One float matrix per feature set, shared by all folds of those candidates
+    matrices = {}
+    for features, _ in candidates.values():
+        key = tuple(features)
+        if key not in matrices:
+            matrices[key] = df[features].to_numpy(dtype=float)
+
+    splits = [
+        (np.flatnonzero(time_codes <= train_times[-1]),
+         np.flatnonzero((time_codes >= val_times[0]) & (time_codes <= val_times[-1])))
+        for train_times, val_times in TimeSeriesSplit(n_splits=cv_folds).split(scan_times)
+    ]
+    print(f"Evaluating {len(candidates)} candidates x {len(splits)} time-ordered folds on {len(df)} rows ({len(scan_times)} scans)...")
+
+    fold_results = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate_fold)(name, make_model, matrices[tuple(features)], y, train_idx, val_idx)
+        for name, (features, make_model) in candidates.items()
+        for train_idx, val_idx in splits
+    )
+
+    # Serving cost: refit each candidate on all rows (in parallel), then time predict
+    # on a fixed LATENCY_ROWS matrix one model at a time, so no fits compete for cores
+    fitted = dict(Parallel(n_jobs=n_jobs)(
+        delayed(fit_full)(name, make_model, matrices[tuple(features)], y)
+        for name, (features, make_model) in candidates.items()
+    ))
+    rng = np.random.default_rng(42)
+    latency_rows = rng.integers(0, len(df), LATENCY_ROWS)
+    predict_ms = {}
+    for name, (features, _) in candidates.items():
+        model, columns = fitted[name]
+        predict_ms[name] = time_predict_ms(model, matrices[tuple(features)][latency_rows][:, columns])
+
+    results = pd.DataFrame(fold_results)
+    leaderboard = results.groupby('model').agg(
+        val_mse=('val_mse', 'mean'),
+        val_mse_std=('val_mse', 'std'),
+        fit_seconds=('fit_seconds', 'mean')
+    )
+    leaderboard[f'predict_ms_per_{LATENCY_ROWS // 1000}k'] = [predict_ms[name] for name in leaderboard.index]
+    leaderboard['val_rmse'] = np.sqrt(leaderboard['val_mse'])
+    leaderboard['n_features'] = [len(candidates[name][0]) for name in leaderboard.index]
+    leaderboard = leaderboard.sort_values('val_mse').reset_index()
+
+    os.makedirs(os.path.dirname(LEADERBOARD_FILE), exist_ok=True)
+    leaderboard.to_csv(LEADERBOARD_FILE, index=False)
+
+    print(leaderboard.to_string(index=False, float_format=lambda value: f"{value:.4f}"))
+    print(f"SUCCESS: Leaderboard saved to {LEADERBOARD_FILE}")
+    return leaderboard
+
 if __name__ == "__main__":
-    # Ensure the model is trained when the script is run directly
-    trained_model = train_and_save_model()
-    # If the script runs successfully, the model is ready!
\ No newline at end of file
+    if '--select' in sys.argv:
+        # Compare candidate models; the served model file is left unchanged
+        select_model()
+    else:
+        # Ensure the model is trained when the script is run directly
+        trained_model = train_and_save_model()
+        # If the script runs successfully, the model is ready!
\ No newline at end of file
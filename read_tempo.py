@@ -1,7 +1,7 @@
 import os
 import numpy as np
 import pandas as pd
-from netCDF4 import Dataset
+from netCDF4 import Dataset, num2date
 
 # --- Configuration ---
 INPUT_FILE_NAME = 'tempo_no2_sample.nc' 
@@ -13,9 +13,39 @@ NO2_VARIABLE_PATH = '/product/vertical_column_troposphere'
 LATITUDE_VARIABLE_PATH = '/geolocation/latitude' 
 LONGITUDE_VARIABLE_PATH = '/geolocation/longitude' 
 QUALITY_FLAG_PATH = '/product/main_data_quality_flag'  # optional
+TIME_VARIABLE_PATH = '/geolocation/time'  # scan time per mirror step (units in the variable)
 
 # ----------------------------------------------------
 
+def read_scan_times(nc_file, pixel_shape):
+    """
+    Returns the UTC scan time of every pixel (flattened like the NO2 array),
+    or None if the file has no usable time information.
+    """
+    n_pixels = int(np.prod(pixel_shape))
+
+    try:
+        time_var = nc_file[TIME_VARIABLE_PATH]
+        times = num2date(time_var[:], time_var.units, only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+        times = pd.to_datetime(np.asarray(times).ravel(), utc=True)
+
+        if len(times) == n_pixels:
+            return times
+        if len(times) == pixel_shape[0]:
+            # One time per mirror step (scan line): repeat across the cross-track pixels
+            return times.repeat(n_pixels // pixel_shape[0])
+        print(f"WARNING: Time variable shape {time_var.shape} does not match NO2 shape {pixel_shape}.")
+    except (IndexError, KeyError, AttributeError, ValueError) as e:
+        print(f"WARNING: Could not read per-pixel scan time from '{TIME_VARIABLE_PATH}': {e}")
+
+    # Fallback: one scan time for the whole granule
+    coverage_start = getattr(nc_file, 'time_coverage_start', None)
+    if coverage_start is not None:
+        print(f"Using granule time_coverage_start ({coverage_start}) as the scan time for all pixels.")
+        return pd.to_datetime(pd.Index([coverage_start]), utc=True).repeat(n_pixels)
+
+    return None
+
 def read_tempo_data():
     """
     Reads a TEMPO satellite data file (.nc), extracts NO2, latitude, and longitude,
@@ -60,6 +90,14 @@ def read_tempo_data():
             else:
                 quality_flat = np.full_like(no2_flat, np.nan)
 
+            # ✅ Scan time per pixel (used for time windows downstream)
+            scan_times = read_scan_times(nc_file, no2_data.shape)
+            if scan_times is None:
+                print("WARNING: No scan time found; 'scan_time_utc' will be empty and time-windowed validation is skipped.")
+                scan_time_flat = np.full(no2_flat.shape, None)
+            else:
+                scan_time_flat = scan_times.strftime('%Y-%m-%dT%H:%M:%SZ')
+
             # ✅ Handle fill/missing values
             FILL_VALUE = -9999.0
             no2_flat = np.where(no2_flat == FILL_VALUE, np.nan, no2_flat)
@@ -69,7 +107,8 @@ def read_tempo_data():
                 'latitude': lat_flat,
                 'longitude': lon_flat,
                 'NO2_column_density': no2_flat,
-                'quality_flag': quality_flat
+                'quality_flag': quality_flat,
+                'scan_time_utc': scan_time_flat
             })
 
             # Remove missing NO2 values
@@ -0,0 +1,372 @@
+# validation_engine.py
+import hashlib
+import heapq
+from functools import reduce
+import pickle
+import os
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+VALIDATION_FILE = '../data_processed/validation_stats.pkl'
+
+# Column names produced by combine_data.py
+SATELLITE_COL = 'NO2_column_density'
+GROUND_COL = 'nearest_openaq_pm25'
+STATION_COL = 'nearest_openaq_station'
+DISTANCE_COL = 'distance_km_to_openaq'
+GROUND_TIME_COL = 'openaq_datetime_utc'
+
+# A pixel and a ground reading are only compared when they are co-located:
+# within this distance (same radius get_openaq.py searches) ...
+MAX_PAIR_DISTANCE_KM = 25.0
+# ... and with the reading taken within this long of the pixel's scan time
+MAX_PAIR_TIME_DELTA = pd.Timedelta(hours=1)
+
+# TEMPO gives a tropospheric NO2 column while OpenAQ gives surface PM2.5: different
+# pollutants in different units, so only their correlation is reported (no bias/RMSE)
+SATELLITE_UNITS = 'molecules/cm^2'
+GROUND_UNITS = 'ug/m^3'
+
+# Sliding windows (in hours) that statistics are maintained for
+WINDOWS_HOURS = {'1h': 1, '24h': 24, '7d': 168}
+DEFAULT_WINDOW = '24h'
+
+# Regions are coarse lat/lon grid cells of this size (degrees)
+REGION_GRID_DEG = 1.0
+
+# Key used for the all-stations aggregate
+OVERALL_KEY = 'all'
+
+# Layout of the (centered) moment vector: [n, mean_x, mean_y, M2_x, M2_y, C_xy]
+# where M2 = sum of squared deviations and C = sum of co-deviations.
+# x = TEMPO satellite NO2 column, y = OpenAQ ground PM2.5
+_MOMENT_COLS = ['_n', '_mean_x', '_mean_y', '_m2_x', '_m2_y', '_c_xy']
+
+
+def region_key(latitude, longitude):
+    """Maps coordinates to the grid-cell key used for regional statistics."""
+    lat_cell = np.floor(np.asarray(latitude, dtype=float) / REGION_GRID_DEG) * REGION_GRID_DEG
+    lon_cell = np.floor(np.asarray(longitude, dtype=float) / REGION_GRID_DEG) * REGION_GRID_DEG
+    return pd.Series(lat_cell).round(2).astype(str).values + '_' + pd.Series(lon_cell).round(2).astype(str).values
+
+
+def merge_moments(a, b):
+    """Combines two centered moment vectors (Chan et al. parallel update)."""
+    n_a, n_b = a[0], b[0]
+    if n_a == 0:
+        return b.copy()
+    if n_b == 0:
+        return a.copy()
+
+    n = n_a + n_b
+    delta_x = b[1] - a[1]
+    delta_y = b[2] - a[2]
+    weight = n_a * n_b / n
+    return np.array([
+        n,
+        a[1] + delta_x * n_b / n,
+        a[2] + delta_y * n_b / n,
+        a[3] + b[3] + delta_x * delta_x * weight,
+        a[4] + b[4] + delta_y * delta_y * weight,
+        a[5] + b[5] + delta_x * delta_y * weight
+    ])
+
+
+def moments_to_stats(moments):
+    """Turns a moment vector into unit-labelled means and the correlation (None when undefined)."""
+    n, mean_x, mean_y, m2_x, m2_y, c_xy = moments
+    if n < 1:
+        return None
+
+    # Pearson correlation; undefined if either side is constant
+    if n >= 2 and m2_x > 0 and m2_y > 0:
+        correlation = float(np.clip(c_xy / np.sqrt(m2_x * m2_y), -1.0, 1.0))
+    else:
+        correlation = None
+
+    return {
+        "count": int(round(n)),
+        "mean_satellite_no2": float(mean_x),
+        "satellite_units": SATELLITE_UNITS,
+        "mean_ground_pm25": float(mean_y),
+        "ground_units": GROUND_UNITS,
+        "correlation": correlation
+    }
+
+
+def hourly_moments(batch, scope):
+    """Centered moments per (key, hour) for one scope, computed in two vectorized passes."""
+    groups = batch.groupby([scope, 'hour'])
+    means = groups[['_sx', '_gy']].transform('mean')
+    dev_x = batch['_sx'] - means['_sx']
+    dev_y = batch['_gy'] - means['_gy']
+
+    deviations = pd.DataFrame({
+        scope: batch[scope],
+        'hour': batch['hour'],
+        '_n': 1.0,
+        '_mean_x': batch['_sx'],
+        '_mean_y': batch['_gy'],
+        '_m2_x': dev_x * dev_x,
+        '_m2_y': dev_y * dev_y,
+        '_c_xy': dev_x * dev_y
+    })
+    return deviations.groupby([scope, 'hour']).agg({
+        '_n': 'sum', '_mean_x': 'mean', '_mean_y': 'mean',
+        '_m2_x': 'sum', '_m2_y': 'sum', '_c_xy': 'sum'
+    })[_MOMENT_COLS]
+
+
+class ValidationEngine:
+    """
+    Keeps satellite-vs-ground validation statistics (TEMPO NO2 vs. OpenAQ PM2.5
+    correlation and means) per station, per region and overall, over sliding
+    time windows.
+
+    A "pair" is one station in one scan hour: the mean NO2 of the co-located
+    pixels around the station against that station's ground reading. Each
+    merged batch is reduced to pairs and then to centered hourly moments (count, means,
+    squared and co-deviations) that are merged into the matching hour buckets.
+    Hours that slide out of a window are dropped, and a key's window totals are
+    re-merged from its hour buckets (at most one per hour in the window), so
+    history is never re-scanned and no rounding error accumulates. Finished
+    statistics are cached per key so the API can serve them with a dictionary
+    lookup.
+    """
+
+    def __init__(self, windows_hours=None):
+        self.windows_hours = dict(windows_hours or WINDOWS_HOURS)
+        # scope -> window -> key -> {hour_bucket: moments}
+        self._buckets = {}
+        # window -> heap of (hour_bucket, scope, key) used for eviction
+        self._expiry = {window: [] for window in self.windows_hours}
+        # scope -> window -> key -> stats dict (what the API serves)
+        self.stats = {}
+        # Latest hour bucket seen; windows end here
+        self.latest_hour = None
+        # batch_id -> latest hour in that batch, so re-running a batch is a no-op
+        self.ingested_batches = {}
+
+    # --- Updating ---
+
+    def update(self, df_batch, batch_id=None):
+        """
+        Folds a newly merged batch (combine_data.py output rows) into the statistics.
+        Only pixels within MAX_PAIR_DISTANCE_KM of their ground station whose
+        reading is within MAX_PAIR_TIME_DELTA of the scan time are used, and
+        they are averaged to one pair per station per scan hour. Returns the
+        number of pairs added.
+        A batch_id that was already ingested is skipped, so re-running the
+        pipeline on the same TEMPO granule does not count its pairs twice.
+        """
+        if batch_id is not None and batch_id in self.ingested_batches:
+            print(f"Validation batch {batch_id} was already ingested. Skipping update.")
+            return 0
+
+        required = ['datetime', 'latitude', 'longitude', SATELLITE_COL, GROUND_COL, DISTANCE_COL, GROUND_TIME_COL]
+        missing = [col for col in required if col not in df_batch.columns]
+        if missing:
+            print(f"WARNING: Validation batch is missing columns {missing}. Skipping update.")
+            return 0
+
+        batch = pd.DataFrame({
+            'datetime': pd.to_datetime(df_batch['datetime'], utc=True, errors='coerce'),
+            'ground_time': pd.to_datetime(df_batch[GROUND_TIME_COL], utc=True, errors='coerce'),
+            '_sx': pd.to_numeric(df_batch[SATELLITE_COL], errors='coerce'),
+            '_gy': pd.to_numeric(df_batch[GROUND_COL], errors='coerce'),
+            'distance_km': pd.to_numeric(df_batch[DISTANCE_COL], errors='coerce'),
+            'latitude': df_batch['latitude'],
+            'longitude': df_batch['longitude'],
+        })
+        if batch['datetime'].isna().all():
+            # Windows need real scan times (read_tempo.py 'scan_time_utc'); never guess them
+            print("WARNING: Validation batch has no valid scan times. Skipping time-windowed update.")
+            return 0
+
+        if STATION_COL in df_batch.columns:
+            # Keep missing station IDs as NaN so they are skipped, not keyed as 'nan'
+            station = df_batch[STATION_COL]
+            batch['station'] = station.where(station.isna(), station.astype(str))
+        else:
+            batch['station'] = np.nan
+        batch.dropna(subset=['datetime', 'ground_time', 'station', '_sx', '_gy', 'distance_km', 'latitude', 'longitude'], inplace=True)
+        # OpenAQ marks invalid readings with negative values (e.g. -1.0)
+        batch = batch[batch['_gy'] >= 0]
+        # Keep only co-located pairs: nearby station, reading taken around the scan time
+        co_located = (batch['distance_km'] <= MAX_PAIR_DISTANCE_KM) & \
+            ((batch['datetime'] - batch['ground_time']).abs() <= MAX_PAIR_TIME_DELTA)
+        batch = batch[co_located]
+
+        if len(batch) == 0:
+            print(f"No TEMPO pixels within {MAX_PAIR_DISTANCE_KM} km and {MAX_PAIR_TIME_DELTA} of a ground reading. Nothing to update.")
+            return 0
+
+        # Hour buckets as integer hours since the epoch (independent of datetime resolution)
+        epoch = pd.Timestamp(0, tz='UTC')
+        batch['hour'] = ((batch['datetime'] - epoch) // pd.Timedelta(hours=1)).astype('int64')
+
+        # One pair per station per scan: a station has one reading, so its pixels
+        # would otherwise count as many "pairs" with a constant ground value
+        batch = batch.groupby(['station', 'hour'], as_index=False).agg(
+            _sx=('_sx', 'mean'),
+            _gy=('_gy', 'mean'),
+            latitude=('latitude', 'mean'),
+            longitude=('longitude', 'mean'),
+        )
+        batch['region'] = region_key(batch['latitude'], batch['longitude'])
+        batch['overall'] = OVERALL_KEY
+
+        batch_latest = int(batch['hour'].max())
+        if self.latest_hour is None or batch_latest > self.latest_hour:
+            self.latest_hour = batch_latest
+        if batch_id is not None:
+            self.ingested_batches[batch_id] = batch_latest
+
+        touched = set()
+        for scope in ('station', 'region', 'overall'):
+            scoped = batch.dropna(subset=[scope])
+            if len(scoped) == 0:
+                continue
+            grouped = hourly_moments(scoped, scope)
+            for (key, hour), row in zip(grouped.index, grouped.values):
+                self._add_bucket(scope, key, int(hour), row, touched)
+
+        self._evict_expired(touched)
+        self._refresh_stats(touched)
+        self._forget_old_batches()
+        return len(batch)
+
+    def _forget_old_batches(self):
+        """Drops batch IDs whose data is older than every window (it would be ignored anyway)."""
+        cutoff = self.latest_hour - max(self.windows_hours.values())
+        self.ingested_batches = {
+            batch_id: hour for batch_id, hour in self.ingested_batches.items() if hour > cutoff
+        }
+
+    def _add_bucket(self, scope, key, hour, moments, touched):
+        """Merges one hourly moment vector into every window that still covers that hour."""
+        for window, hours in self.windows_hours.items():
+            if hour <= self.latest_hour - hours:
+                continue  # Already outside this window
+
+            buckets = self._buckets.setdefault(scope, {}).setdefault(window, {}).setdefault(key, {})
+            if hour in buckets:
+                buckets[hour] = merge_moments(buckets[hour], moments)
+            else:
+                buckets[hour] = moments.copy()
+                heapq.heappush(self._expiry[window], (hour, scope, key))
+            touched.add((scope, window, key))
+
+    def _evict_expired(self, touched):
+        """Drops hour buckets that have slid out of each window."""
+        for window, hours in self.windows_hours.items():
+            cutoff = self.latest_hour - hours
+            heap = self._expiry[window]
+            while heap and heap[0][0] <= cutoff:
+                hour, scope, key = heapq.heappop(heap)
+                buckets = self._buckets[scope][window][key]
+                buckets.pop(hour)
+
+                if not buckets:
+                    # No data left in this window for the key
+                    del self._buckets[scope][window][key]
+                touched.add((scope, window, key))
+
+    def _refresh_stats(self, touched):
+        """Re-merges the hour buckets of keys that changed and caches their statistics."""
+        for scope, window, key in touched:
+            cache = self.stats.setdefault(scope, {}).setdefault(window, {})
+            buckets = self._buckets.get(scope, {}).get(window, {}).get(key)
+            result = moments_to_stats(reduce(merge_moments, buckets.values())) if buckets else None
+            if result is None:
+                cache.pop(key, None)
+            else:
+                cache[key] = result
+
+    # --- Serving ---
+
+    def get_stats(self, scope='overall', key=OVERALL_KEY, window=DEFAULT_WINDOW):
+        """Returns the cached statistics for one scope/key/window, or None."""
+        return self.stats.get(scope, {}).get(window, {}).get(key)
+
+    def window_end_utc(self):
+        """ISO timestamp of the hour the sliding windows currently end at."""
+        if self.latest_hour is None:
+            return None
+        return (pd.Timestamp(0, tz='UTC') + pd.Timedelta(hours=self.latest_hour + 1)).isoformat()
+
+
+def lookup_stats(engine, args):
+    """
+    Resolves API query args (station=<id> or region=<lat_lon cell>, window=1h|24h|7d;
+    overall aggregate by default) to the engine's cached statistics.
+    """
+    window = args.get('window', DEFAULT_WINDOW)
+    if args.get('station'):
+        scope, key = 'station', args['station']
+    elif args.get('region'):
+        scope, key = 'region', args['region']
+    else:
+        scope, key = 'overall', OVERALL_KEY
+
+    return {
+        "scope": scope,
+        "key": key,
+        "window": window,
+        "window_end_utc": engine.window_end_utc(),
+        "statistics": engine.get_stats(scope, key, window)
+    }
+
+
+def file_batch_id(path):
+    """Content hash of an input file, used as the batch ID for update()."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_engine(path=VALIDATION_FILE):
+    """Loads a saved engine, or returns a fresh one if none exists yet."""
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    return ValidationEngine()
+
+
+# Cache for current_engine(): path -> (mtime, engine)
+_engine_cache = {}
+
+
+def current_engine(path=VALIDATION_FILE):
+    """
+    Returns the saved engine for the API servers, re-loading it only when
+    combine_data.py has written a newer file (one os.stat per call).
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    cached = _engine_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            engine = load_engine(path)
+        except Exception as e:
+            print(f"ERROR: Failed to load validation statistics from {path}. Error: {e}")
+            engine = cached[1] if cached else ValidationEngine()
+        cached = (mtime, engine)
+        _engine_cache[path] = cached
+    return cached[1]
+
+
+def save_engine(engine, path=VALIDATION_FILE):
+    """Persists the engine so the API servers can load the latest statistics."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so a server never reads a half-written file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(engine, file)
+    os.replace(tmp_path, path)